@@ -81,7 +81,4 @@ async def test_db():
         print(f"❌ General Error: {e}")
 
 if __name__ == "__main__":
-    # Fix for Windows asyncio loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(test_db())
+    asyncio.run(test_db())
@@ -1,17 +1,20 @@
 import os
 import logging
+import re
 import asyncio
+import concurrent.futures
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, status
-from fastapi.responses import JSONResponse
+from typing import List, Optional, Dict, Any, Tuple
+from fastapi import FastAPI, Request, HTTPException, status
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
 import google.generativeai as genai
-from groq import Groq
+from groq import AsyncGroq
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-import requests
+import httpx
+import orjson
 from dotenv import load_dotenv
 from PIL import Image
 import io
@@ -39,26 +42,64 @@ VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 if not all([SUPABASE_URL, SUPABASE_KEY, GEMINI_API_KEY, WHATSAPP_TOKEN, WHATSAPP_PHONE_ID]):
     logger.warning("Missing some environment variables. Ensure .env is set correctly.")
 
-# Initialize Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase async client (created lazily on the running loop so queries await
+# on a socket instead of hopping through the ThreadPoolExecutor)
+supabase: Optional[AsyncClient] = None
+
+async def get_supabase() -> AsyncClient:
+    global supabase
+    if supabase is None:
+        supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    return supabase
 
 # Initialize Gemini (Primary AI)
 genai.configure(api_key=GEMINI_API_KEY)
 
+# --- MULTI-MODEL FALLBACK SYSTEM (validated by fix_jiva.py) ---
+# Status: 1.5-Flash returns 404 (Broken). 2.0-Flash returns 429 (Valid but Busy).
+# Strategy: Use 2.0 models ONLY and WAIT on rate limits.
+# Model handles are stateless, so build them once instead of re-instantiating
+# per webhook.
+MODELS_TO_TRY = [
+    "gemini-2.0-flash",         # Verified Exists (returns 429)
+    "gemini-2.0-flash-lite-001" # Verified Exists (returns 429)
+]
+GEMINI_MODELS = {name: genai.GenerativeModel(name) for name in MODELS_TO_TRY}
+
+# Cap each upstream AI attempt so a slow model doesn't delay the fallback chain.
+GEMINI_TIMEOUT = 8   # seconds per Gemini attempt
+GROQ_TIMEOUT = 15    # seconds for the Groq fallback
+
 # Initialize Groq (Fallback AI)
 groq_client = None
 if GROQ_API_KEY:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    groq_client = AsyncGroq(api_key=GROQ_API_KEY)
     logger.info("✅ Groq fallback enabled")
 else:
     logger.warning("⚠️ GROQ_API_KEY not found. Fallback disabled.")
 
 # Initialize FastAPI
-app = FastAPI(title="Jiva - AI Health Guardian")
+app = FastAPI(title="Jiva - AI Health Guardian", default_response_class=ORJSONResponse)
 
 # Initialize Scheduler
 scheduler = AsyncIOScheduler(timezone="Asia/Kolkata")
 
+# Shared async HTTP client for Meta Graph calls (created on startup, closed on shutdown).
+# HTTP/2 + keep-alive lets concurrent webhook tasks overlap their Graph API calls
+# instead of paying a fresh TCP+TLS handshake per message.
+whatsapp_client: Optional[httpx.AsyncClient] = None
+
+def _get_whatsapp_client() -> httpx.AsyncClient:
+    global whatsapp_client
+    if whatsapp_client is None:
+        whatsapp_client = httpx.AsyncClient(
+            http2=True,
+            timeout=15,
+            limits=httpx.Limits(max_keepalive_connections=20),
+            headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"},
+        )
+    return whatsapp_client
+
 # --- Database Models & Helpers ---
 
 class User(BaseModel):
@@ -71,18 +112,25 @@ class User(BaseModel):
     medical_history: Optional[str] = None
     emergency_contact: Optional[str] = None
 
-# Helper to run blocking calling in thread pool
-async def async_supabase(query):
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, query.execute)
+# In-process TTL caches: the same user usually sends several messages per
+# session, so warm lookups skip the Supabase round trip entirely. Writes
+# invalidate their entry so the next read is fresh.
+USER_CACHE_TTL = 60   # seconds
+HISTORY_CACHE_TTL = 10
+_user_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_history_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
 
 async def get_user(phone_number: str) -> Optional[Dict[str, Any]]:
+    cached = _user_cache.get(phone_number)
+    if cached and time.monotonic() - cached[0] < USER_CACHE_TTL:
+        return cached[1]
     try:
-        response = await async_supabase(
-            supabase.table("users").select("*").eq("phone_number", phone_number)
-        )
+        db = await get_supabase()
+        response = await db.table("users").select("*").eq("phone_number", phone_number).execute()
         if response.data:
-            return response.data[0]
+            user = response.data[0]
+            _user_cache[phone_number] = (time.monotonic(), user)
+            return user
         return None
     except Exception as e:
         logger.error(f"Error fetching user: {e}")
@@ -90,70 +138,79 @@ async def get_user(phone_number: str) -> Optional[Dict[str, Any]]:
 
 async def create_user(phone_number: str, name: str):
     try:
-        await async_supabase(
-            supabase.table("users").insert({"phone_number": phone_number, "name": name})
-        )
+        db = await get_supabase()
+        await db.table("users").insert({"phone_number": phone_number, "name": name}).execute()
     except Exception as e:
         logger.error(f"Error creating user: {e}")
 
 async def update_user_profile(phone_number: str, updates: Dict[str, Any]):
+     _user_cache.pop(phone_number, None)
      try:
-        await async_supabase(
-            supabase.table("users").update(updates).eq("phone_number", phone_number)
-        )
+        db = await get_supabase()
+        await db.table("users").update(updates).eq("phone_number", phone_number).execute()
      except Exception as e:
         logger.error(f"Error updating user profile: {e}")
 
 async def get_chat_history(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    cached = _history_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < HISTORY_CACHE_TTL:
+        return cached[1]
     try:
-        response = await async_supabase(
-            supabase.table("chat_history")\
-            .select("*")\
+        db = await get_supabase()
+        # Only role/content feed the prompt — skip timestamps and metadata
+        response = await db.table("chat_history")\
+            .select("role,content")\
             .eq("user_id", user_id)\
             .order("created_at", desc=True)\
-            .limit(limit)
-        )
-        return response.data[::-1] if response.data else [] # Return in chronological order
+            .limit(limit)\
+            .execute()
+        history = list(reversed(response.data)) if response.data else [] # Return in chronological order
+        _history_cache[user_id] = (time.monotonic(), history)
+        return history
     except Exception as e:
         logger.error(f"Error fetching chat history: {e}")
         return []
 
-async def save_message(user_id: str, role: str, content: str):
+async def save_messages(user_id: str, messages: List[Tuple[str, str]]):
+    """Saves (role, content) pairs in one batched insert — one round trip instead of N."""
+    _history_cache.pop(user_id, None)
     try:
-        await async_supabase(
-            supabase.table("chat_history").insert({
-                "user_id": user_id,
-                "role": role,
-                "content": content
-            })
-        )
+        db = await get_supabase()
+        rows = [
+            {"user_id": user_id, "role": role, "content": content}
+            for role, content in messages
+        ]
+        await db.table("chat_history").insert(rows).execute()
     except Exception as e:
-        logger.error(f"Error saving message: {e}")
+        logger.error(f"Error saving messages: {e}")
+
+# Set whenever a reminder is written so schedulers can wake immediately
+# instead of sitting out the rest of their poll interval.
+reminder_wake = asyncio.Event()
 
 async def create_reminder(user_id: str, reminder_time: datetime, message: str):
     try:
-        await async_supabase(
-            supabase.table("reminders").insert({
-                "user_id": user_id,
-                "reminder_time": reminder_time.isoformat(),
-                "message": message,
-                "status": "pending"
-            })
-        )
+        db = await get_supabase()
+        await db.table("reminders").insert({
+            "user_id": user_id,
+            "reminder_time": reminder_time.isoformat(),
+            "message": message,
+            "status": "pending"
+        }).execute()
+        reminder_wake.set()
     except Exception as e:
         logger.error(f"Error creating reminder: {e}")
 
 # --- WhatsApp Integration ---
 
-def validate_whatsapp_token():
+async def validate_whatsapp_token():
     """Validates the WhatsApp token on startup. Logs a clear error if expired."""
     if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_ID:
         logger.critical("❌ WHATSAPP_ACCESS_TOKEN or WHATSAPP_PHONE_NUMBER_ID is missing from .env!")
         return False
     url = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_ID}"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = await _get_whatsapp_client().get(url, timeout=10)
         if response.status_code == 200:
             logger.info("✅ WhatsApp Token is VALID and active.")
             return True
@@ -167,17 +224,13 @@ def validate_whatsapp_token():
         else:
             logger.warning(f"⚠️ WhatsApp token check returned status {response.status_code}: {response.text}")
             return False
-    except Exception as e:
+    except httpx.HTTPError as e:
         logger.error(f"Could not validate WhatsApp token: {e}")
         return False
 
-def send_whatsapp_message(to_phone: str, message: str) -> bool:
+async def send_whatsapp_message(to_phone: str, message: str) -> bool:
     """Sends a WhatsApp message. Returns True on success, False on failure."""
     url = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json",
-    }
     data = {
         "messaging_product": "whatsapp",
         "to": to_phone,
@@ -185,7 +238,7 @@ def send_whatsapp_message(to_phone: str, message: str) -> bool:
         "text": {"body": message},
     }
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=15)
+        response = await _get_whatsapp_client().post(url, json=data)
         if response.status_code == 200:
             logger.info(f"✅ WhatsApp message sent to {to_phone}")
             return True
@@ -198,42 +251,169 @@ def send_whatsapp_message(to_phone: str, message: str) -> bool:
         else:
             logger.error(f"❌ WhatsApp API error {response.status_code}: {response.text}")
             return False
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("❌ WhatsApp API timed out. Will retry next time.")
         return False
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"❌ Failed to send WhatsApp message: {e}")
         return False
 
 async def get_media_url(media_id: str) -> Optional[str]:
     url = f"https://graph.facebook.com/v18.0/{media_id}"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = await _get_whatsapp_client().get(url, timeout=10)
         if response.status_code == 401:
             logger.critical("🚨 TOKEN EXPIRED while fetching media URL.")
             return None
         response.raise_for_status()
         return response.json().get("url")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Failed to get media URL: {e}")
         return None
 
 async def download_media(media_url: str) -> Tuple[Optional[bytes], Optional[str]]:
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
     try:
-        response = requests.get(media_url, headers=headers, timeout=30)
+        response = await _get_whatsapp_client().get(media_url, timeout=30)
         if response.status_code == 401:
             logger.critical("🚨 TOKEN EXPIRED while downloading media.")
             return None, None
         response.raise_for_status()
         return response.content, response.headers.get("Content-Type")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Failed to download media: {e}")
         return None, None
 
 # --- AI Logic ---
 
+# strftime is surprisingly slow (locale + format parsing); amortize it
+# across every webhook that lands within the same minute.
+_TIME_CACHE = [0, "", 0]  # [epoch_minute, formatted, hour]
+
+def _now_formatted() -> Tuple[str, int]:
+    m = int(time.time() // 60)
+    if _TIME_CACHE[0] != m:
+        dt = datetime.now()
+        _TIME_CACHE[:] = [m, dt.strftime("%Y-%m-%d %I:%M %p"), dt.hour]
+    return _TIME_CACHE[1], _TIME_CACHE[2]
+
+# Response tags like [[UPDATE_PROFILE: {...}]] are parsed with patterns
+# compiled once at import instead of manual str.find scanning per reply.
+# The (?!\]) lookahead makes the closing ]] land after a JSON list's own
+# bracket (e.g. [[SCHEDULE_REMINDERS: [{...}]]]).
+TAG_PATTERNS = {
+    "UPDATE_PROFILE": re.compile(r"\[\[UPDATE_PROFILE:\s*(.*?)\]\](?!\])", re.DOTALL),
+    "SCHEDULE_REMINDERS": re.compile(r"\[\[SCHEDULE_REMINDERS:\s*(.*?)\]\](?!\])", re.DOTALL),
+}
+
+def extract_json(tag: str, text: str):
+    """Extracts the JSON payload of a [[TAG: ...]] marker from a reply.
+
+    Returns (payload, text_without_tag). payload is None if the tag is
+    absent or its JSON is malformed; the tag is stripped either way.
+    """
+    pattern = TAG_PATTERNS[tag]
+    m = pattern.search(text)
+    if not m:
+        return None, text
+    cleaned = pattern.sub("", text, count=1).strip()
+    try:
+        return orjson.loads(m.group(1)), cleaned
+    except orjson.JSONDecodeError as e:
+        logger.error(f"JSON Error: {e}")
+        return None, cleaned
+
+# (label, column) pairs for the prompt's user-context block
+_PROFILE_FIELDS = (
+    ("Age", "age"),
+    ("Gender", "gender"),
+    ("Allergies", "allergies"),
+    ("History", "medical_history"),
+    ("Emergency Contact", "emergency_contact"),
+)
+
+# Hour-of-day greeting guidance, precomputed once; indexed with the cached
+# hour instead of re-running the comparison ladder per request.
+_HOUR_TEMPLATES = tuple(
+    "Use morning greeting: 'Good morning {n}! Kaisi tabiyat hai aaj?'" if 6 <= h < 12
+    else "Use afternoon greeting: 'Hello {n}! Kya haal hai?'" if 12 <= h < 17
+    else "Use evening greeting: 'Namaste {n}! Sab theek?'" if 17 <= h < 21
+    else "Use night greeting: 'Hi {n}! Abhi tak jaage?'"
+    for h in range(24)
+)
+
+# The bulk of the system prompt never changes per request; build it once at
+# import time and only f-format the small dynamic context tail per message.
+SYSTEM_INSTRUCTION_STATIC = """
+You are **Jiva - An Advanced AI Health Assistant**.
+
+🎯 **YOUR MISSION**:
+Provide **professional, medically-grounded, and actionable** health guidance. You are NOT a replacement for a doctor, but you are a **highly intelligent medical triage assistant**.
+
+🚫 **CRITICAL RULES (STRICT COMPLIANCE REQUIRED)**:
+1. **NO REPETITIVE GREETINGS**: Do NOT say "Namaste", "Hello", or introduce yourself in every message. Only greet IF the user explicitly greets you first (e.g., "Hi Jiva"). Otherwise, **ANSWER DIRECTLY**.
+2. **NO GENERIC "CHAI/DOLO" ADVICE**: Do not suggest medicines unless you have analyzed the symptoms. "Drink tea" is not a medical solution for everything.
+3. **EMERGENCY FIRST**: If symptoms suggest a crisis (Heart attack, Stroke, Severe Bleeding, Breathing difficulty), **STOP EVERYTHING** and trigger the Emergency Protocol immediately.
+
+🧬 **MEDICAL TRIAGE PROTOCOL (follow this flow)**:
+
+**PHASE 1: ASSESSMENT (The "Doctor's Mind")**
+- Don't just accept "Headache". Ask: *Location? Type (throbbing/dull)? Duration? Associated symptoms (nausea, vision obs)?*
+- Max 2-3 sharp, clinical questions to narrow down the cause.
+
+**PHASE 2: DIFFERENTIAL ANALYSIS**
+- Based on answers, think: "Could this turn into a migraine? Or is it just stress?"
+- Explain your reasoning briefly to the user.
+
+**PHASE 3: MANAGEMENT PLAN**
+- **Primary**: Immediate relief measures (Positioning, Breathing, Hydration).
+- **Secondary**: Safe OTC medications (Paracetamol 650mg, ORS, Antacids) - *Always mention dosage warnings*.
+- **Tertiary**: Home/Natural remedies (only if clinically supported, e.g., Steam key for congestion).
+
+🚨 **EMERGENCY RESPONSE FORMAT (When specific keywords detected: Chest pain, breathless, collapsed)**:
+"🚨 **CRITICAL MEDICAL ALERT**
+• **IMMEDIATE ACTION**: [Specific life-saving step, e.g., 'Sit down, chew Aspirin 300mg']
+• **CALL EMERGENCY**: Dial **108** or **102** NOW.
+• **HOSPITAL**: Go to the nearest ER immediately.
+[[SOS]]"
+(The [[SOS]] tag triggers an alert to their family. USE IT for serious threats.)
+
+💊 **PRESCRIPTION & REPORT ANALYSIS**:
+If an image is provided:
+1. **Identify**: Is it a Prescription? Lab Report? Medicine Strip?
+2. **Extract**: Doctor's Name, Patient Name, Medicines (Name + Dosage + Frequency).
+3. **Action**: Explain what the medicine is for.
+4. **Scheduling**: Create reminders using the tag [[SCHEDULE_REMINDERS: [{"message": "Take Metformin", "time": "2023-10-27T09:00:00"}]]]
+
+🗣️ **TONE & STYLE**:
+- **Professional & Assuring**: Like a senior resident doctor.
+- **Direct**: Get to the point. No fluff.
+- **Structured**: Use Bullet points.
+- **Indian Context**: Understand Indian brand names (Crocin, Dolo, Pan D, Azithral) and diet.
+
+**EXAMPLE (Good Response)**:
+User: "I have a severe headache on one side."
+Jiva: "Is there any nausea or sensitivity to light? How long has it been hurting?
+It sounds like it could be a **Migraine**.
+• **Immediate**: Go to a dark, quiet room. Rest.
+• **Meds**: You can take a Paracetamol (Dolo 650) if you have no allergies. If it persists > 24hrs, see a doctor.
+• **Hydrate**: Drink water slowly."
+
+**EXAMPLE (Bad Response)**:
+User: "Headache."
+Jiva: "Namaste! Have some chai and take rest. Everything will be fine." (❌ TOO SIMPLE)
+"""
+
+# Images above this size get downscaled before upload to cap Gemini
+# latency and cost; smaller ones are passed through untouched.
+MAX_IMAGE_BYTES = 2_000_000
+
+def _downscale_image(data: bytes) -> Tuple[bytes, str]:
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    img.thumbnail((1024, 1024), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue(), "image/jpeg"
+
 async def processing_pipeline(user_phone: str, message_body: str, media_id: str = None):
     # 1. Check User Existence
     user = await get_user(user_phone)
@@ -241,7 +421,7 @@ async def processing_pipeline(user_phone: str, message_body: str, media_id: str
     if not user:
         await create_user(user_phone, "Pending")
         # First-time greeting
-        send_whatsapp_message(user_phone, "Jai Shree Shyam! Namaste! I am Jiva, your personal Health Guardian. Before we start, may I know your good name?")
+        await send_whatsapp_message(user_phone, "Jai Shree Shyam! Namaste! I am Jiva, your personal Health Guardian. Before we start, may I know your good name?")
         return 
 
     if user.get("name") == "Pending":
@@ -250,23 +430,20 @@ async def processing_pipeline(user_phone: str, message_body: str, media_id: str
         # Update user
         try:
              await update_user_profile(user_phone, {"name": new_name})
-             send_whatsapp_message(user_phone, f"Namaste {new_name}! I am ready to help you with your health. How are you feeling today?")
+             await send_whatsapp_message(user_phone, f"Namaste {new_name}! I am ready to help you with your health. How are you feeling today?")
         except Exception as e:
             logger.error(f"Failed to update name: {e}")
-            send_whatsapp_message(user_phone, "I had trouble saving your name. But let's continue. How can I help?")
+            await send_whatsapp_message(user_phone, "I had trouble saving your name. But let's continue. How can I help?")
         return
 
     # Normal Flow
     user_id = user['id']
     user_name = user.get('name', 'Friend')
     
-    # Construct User Profile String
-    profile_str = f"Name: {user_name}\n"
-    if user.get('age'): profile_str += f"Age: {user['age']}\n"
-    if user.get('gender'): profile_str += f"Gender: {user['gender']}\n"
-    if user.get('allergies'): profile_str += f"Allergies: {user['allergies']}\n"
-    if user.get('medical_history'): profile_str += f"History: {user['medical_history']}\n"
-    if user.get('emergency_contact'): profile_str += f"Emergency Contact: {user['emergency_contact']}\n"
+    # Construct User Profile String (single join instead of repeated +=)
+    profile_str = f"Name: {user_name}\n" + "".join(
+        f"{label}: {user[key]}\n" for label, key in _PROFILE_FIELDS if user.get(key)
+    )
 
     # 2. Fetch Context
     chat_history = await get_chat_history(user_id)
@@ -281,8 +458,13 @@ async def processing_pipeline(user_phone: str, message_body: str, media_id: str
             media_data, mime_type = await download_media(media_url)
             if media_data:
                 if mime_type and mime_type.startswith("image"):
-                    image = Image.open(io.BytesIO(media_data))
-                    media_part = image
+                    # Gemini takes the raw encoded bytes directly (same
+                    # shape as the audio path), so the Pillow decode +
+                    # re-encode cycle is only paid for oversized uploads.
+                    # The downscale still runs in a worker thread.
+                    if len(media_data) > MAX_IMAGE_BYTES:
+                        media_data, mime_type = await asyncio.to_thread(_downscale_image, media_data)
+                    media_part = {"mime_type": mime_type, "data": media_data}
                     media_type_label = "Image"
                     message_body += "\n[System: User uploaded an medical image/prescription]"
                 elif mime_type and mime_type.startswith("audio"):
@@ -293,10 +475,7 @@ async def processing_pipeline(user_phone: str, message_body: str, media_id: str
                     logger.warning(f"Unsupported media type: {mime_type}")
 
     # 4. Construct Prompt
-    current_time = datetime.now().strftime("%Y-%m-%d %I:%M %p")
-    
-    # Determine greeting based on context
-    hour = datetime.now().hour
+    current_time, hour = _now_formatted()
     # Only force intro if strictly no history AND user name suggests newness, or just rely on time
     is_first_message = len(chat_history) == 0
     
@@ -306,78 +485,14 @@ async def processing_pipeline(user_phone: str, message_body: str, media_id: str
          # Only introduce yourself if the user just said "Hi" or "Hello".
          # This prevents repetitive intros if chat history fails or races.
          greeting_guide = f"Context: No chat history found. If user asks a specific question, ANSWER DIRECTLY (do not introduce yourself). If user says 'Hi'/'Hello', say: 'Namaste {user_name}! Main Jiva hoon.'"
-    elif 6 <= hour < 12:
-        greeting_guide = f"Use morning greeting: 'Good morning {user_name}! Kaisi tabiyat hai aaj?'"
-    elif 12 <= hour < 17:
-        greeting_guide = f"Use afternoon greeting: 'Hello {user_name}! Kya haal hai?'"
-    elif 17 <= hour < 21:
-        greeting_guide = f"Use evening greeting: 'Namaste {user_name}! Sab theek?'"
     else:
-        greeting_guide = f"Use night greeting: 'Hi {user_name}! Abhi tak jaage?'"
+        greeting_guide = _HOUR_TEMPLATES[hour].format(n=user_name)
     
-    system_instruction = f"""
-You are **Jiva - An Advanced AI Health Assistant**.
-
-🎯 **YOUR MISSION**:
-Provide **professional, medically-grounded, and actionable** health guidance. You are NOT a replacement for a doctor, but you are a **highly intelligent medical triage assistant**.
-
-🚫 **CRITICAL RULES (STRICT COMPLIANCE REQUIRED)**:
-1. **NO REPETITIVE GREETINGS**: Do NOT say "Namaste", "Hello", or introduce yourself in every message. Only greet IF the user explicitly greets you first (e.g., "Hi Jiva"). Otherwise, **ANSWER DIRECTLY**.
-2. **NO GENERIC "CHAI/DOLO" ADVICE**: Do not suggest medicines unless you have analyzed the symptoms. "Drink tea" is not a medical solution for everything.
-3. **EMERGENCY FIRST**: If symptoms suggest a crisis (Heart attack, Stroke, Severe Bleeding, Breathing difficulty), **STOP EVERYTHING** and trigger the Emergency Protocol immediately.
-
-🧬 **MEDICAL TRIAGE PROTOCOL (follow this flow)**:
-
-**PHASE 1: ASSESSMENT (The "Doctor's Mind")**
-- Don't just accept "Headache". Ask: *Location? Type (throbbing/dull)? Duration? Associated symptoms (nausea, vision obs)?*
-- Max 2-3 sharp, clinical questions to narrow down the cause.
-
-**PHASE 2: DIFFERENTIAL ANALYSIS**
-- Based on answers, think: "Could this turn into a migraine? Or is it just stress?"
-- Explain your reasoning briefly to the user.
-
-**PHASE 3: MANAGEMENT PLAN**
-- **Primary**: Immediate relief measures (Positioning, Breathing, Hydration).
-- **Secondary**: Safe OTC medications (Paracetamol 650mg, ORS, Antacids) - *Always mention dosage warnings*.
-- **Tertiary**: Home/Natural remedies (only if clinically supported, e.g., Steam key for congestion).
-
+    system_instruction = SYSTEM_INSTRUCTION_STATIC + f"""
 ⏰ **CURRENT CONTEXT**:
 Time: {current_time}
 User Context: {profile_str}
 Greeting Guidance: "{greeting_guide}" (Use this ONLY if conversation just started. Otherwise IGNORE.)
-
-🚨 **EMERGENCY RESPONSE FORMAT (When specific keywords detected: Chest pain, breathless, collapsed)**:
-"🚨 **CRITICAL MEDICAL ALERT**
-• **IMMEDIATE ACTION**: [Specific life-saving step, e.g., 'Sit down, chew Aspirin 300mg']
-• **CALL EMERGENCY**: Dial **108** or **102** NOW.
-• **HOSPITAL**: Go to the nearest ER immediately.
-[[SOS]]" 
-(The [[SOS]] tag triggers an alert to their family. USE IT for serious threats.)
-
-💊 **PRESCRIPTION & REPORT ANALYSIS**:
-If an image is provided:
-1. **Identify**: Is it a Prescription? Lab Report? Medicine Strip?
-2. **Extract**: Doctor's Name, Patient Name, Medicines (Name + Dosage + Frequency).
-3. **Action**: Explain what the medicine is for. 
-4. **Scheduling**: Create reminders using the tag [[SCHEDULE_REMINDERS: [{{"message": "Take Metformin", "time": "2023-10-27T09:00:00"}}]]]
-
-🗣️ **TONE & STYLE**:
-- **Professional & Assuring**: Like a senior resident doctor.
-- **Direct**: Get to the point. No fluff.
-- **Structured**: Use Bullet points.
-- **Indian Context**: Understand Indian brand names (Crocin, Dolo, Pan D, Azithral) and diet.
-
-**EXAMPLE (Good Response)**:
-User: "I have a severe headache on one side."
-Jiva: "Is there any nausea or sensitivity to light? How long has it been hurting?
-It sounds like it could be a **Migraine**.
-• **Immediate**: Go to a dark, quiet room. Rest.
-• **Meds**: You can take a Paracetamol (Dolo 650) if you have no allergies. If it persists > 24hrs, see a doctor.
-• **Hydrate**: Drink water slowly."
-
-**EXAMPLE (Bad Response)**:
-User: "Headache."
-Jiva: "Namaste! Have some chai and take rest. Everything will be fine." (❌ TOO SIMPLE)
 """
 
     history_content = []
@@ -385,32 +500,19 @@ Jiva: "Namaste! Have some chai and take rest. Everything will be fine." (❌ TOO
         role = "user" if msg['role'] == "user" else "model"
         history_content.append({"role": role, "parts": [msg['content']]})
 
-    # --- MULTI-MODEL FALLBACK SYSTEM (validated by fix_jiva.py) ---
-    # Status: 1.5-Flash returns 404 (Broken). 2.0-Flash returns 429 (Valid but Busy).
-    # Strategy: Use 2.0 models ONLY and WAIT on rate limits.
-    
-    print("--------------------------------------------------")
-    print("--- 🚀 RELOADING JIVA BRAINS (VERSION: 2.0-ONLY) ---")
-    print("--------------------------------------------------")
-
-    models_to_try = [
-        "gemini-2.0-flash",         # Verified Exists (returns 429)
-        "gemini-2.0-flash-lite-001" # Verified Exists (returns 429)
-    ]
-    
     response_text = ""
     success = False
-    
-    import time
-    
-    for model_name in models_to_try:
+
+    for model_name in MODELS_TO_TRY:
         try:
-            # Configure Model dynamically
-            current_model = genai.GenerativeModel(model_name)
-            
+            current_model = GEMINI_MODELS[model_name]
+
             if media_part:
                 # Media Generation (One-shot)
-                response = current_model.generate_content([system_instruction, f"User's {media_type_label}:", media_part, "User's Query:", message_body])
+                response = await asyncio.wait_for(
+                    current_model.generate_content_async([system_instruction, f"User's {media_type_label}:", media_part, "User's Query:", message_body]),
+                    timeout=GEMINI_TIMEOUT,
+                )
                 response_text = response.text
                 success = True
                 logger.info(f"✅ Success with {model_name}")
@@ -420,13 +522,19 @@ Jiva: "Namaste! Have some chai and take rest. Everything will be fine." (❌ TOO
                 start_time = time.time()
                 chat_session = current_model.start_chat(history=history_content)
                 prompt = f"{system_instruction}\n\nUser: {message_body}"
-                
-                response = chat_session.send_message(prompt)
+
+                response = await asyncio.wait_for(
+                    chat_session.send_message_async(prompt),
+                    timeout=GEMINI_TIMEOUT,
+                )
                 response_text = response.text
                 success = True
                 logger.info(f"✅ Success with {model_name} (took {round(time.time() - start_time, 2)}s)")
                 break
-                
+
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ {model_name} exceeded {GEMINI_TIMEOUT}s. Switching to next model...")
+            continue
         except Exception as e:
             error_str = str(e).lower()
             if "429" in error_str or "quota" in error_str or "exhausted" in error_str:
@@ -447,14 +555,17 @@ Jiva: "Namaste! Have some chai and take rest. Everything will be fine." (❌ TOO
     if not success and groq_client:
         logger.warning("🔄 Gemini quota exhausted. Switching to GROQ fallback...")
         try:
-            groq_response = groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": message_body}
-                ],
-                temperature=0.7,
-                max_tokens=1024
+            groq_response = await asyncio.wait_for(
+                groq_client.chat.completions.create(
+                    model="llama-3.3-70b-versatile",
+                    messages=[
+                        {"role": "system", "content": system_instruction},
+                        {"role": "user", "content": message_body}
+                    ],
+                    temperature=0.7,
+                    max_tokens=1024
+                ),
+                timeout=GROQ_TIMEOUT,
             )
             response_text = groq_response.choices[0].message.content
             success = True
@@ -465,60 +576,43 @@ Jiva: "Namaste! Have some chai and take rest. Everything will be fine." (❌ TOO
     if not success:
         logger.error("ALL AI SYSTEMS FAILED (Gemini + Groq).")
         response_text = "⚠️ Server Overload: All AI systems are busy. Emergency? Call 108 immediately."
-        final_reply = response_text
-        import json
-        
-        # Helper to clean response
-        def extract_json(tag, text):
-            if tag in text:
-                try:
-                    s = text.find(tag)
-                    e = text.find("]]", s)
-                    json_str = text[s + len(tag) : e]
-                    return json.loads(json_str), text[:s].strip()
-                except Exception as e:
-                    logger.error(f"JSON Error: {e}")
-                    return None, text.replace(f"{tag} {json_str}]]", "").strip()
-            return None, text
-
-        # Check for Profile Update
-        updates, final_reply = extract_json("[[UPDATE_PROFILE:", final_reply)
-        if updates:
-            await update_user_profile(user_phone, updates)
-            if "emergency_contact" in updates:
-                 final_reply += f"\n(✅ Saved Emergency Contact: {updates['emergency_contact']})"
-
-        # Check for Batch Reminders
-        reminder_list, final_reply = extract_json("[[SCHEDULE_REMINDERS:", final_reply)
-        if reminder_list:
-            try:
-                for item in reminder_list:
-                    r_time = datetime.fromisoformat(item['time'])
-                    await create_reminder(user_id, r_time, item['message'])
-                    logger.info(f"Reminder set for {r_time}")
-            except Exception as e:
-                logger.error(f"Reminder Batch Error: {e}")
-        
-        # Check for SOS
-        if "[[SOS]]" in response_text:
-            final_reply = final_reply.replace("[[SOS]]", "").strip()
-            contact = user.get('emergency_contact')
-            if contact:
-                logger.warning(f"SOS Triggered for user {user_phone}")
-                send_whatsapp_message(contact, f"🚨 EMERGENCY: {user_name} ({user_phone}) needs help! Message: '{message_body}'")
-                final_reply += "\n\n🚨 **I HAVE ALERTED YOUR EMERGENCY CONTACT.** Help is on the way."
-            else:
-                 final_reply += "\n\n⚠️ **I tried to alert your family, but NO Emergency Contact is saved!** Please call 102/108 immediately."
 
-        # 6. Save interactions
-        await save_message(user_id, "user", message_body) 
-        await save_message(user_id, "assistant", final_reply)
-        
-        # 7. Send Response
-        send_whatsapp_message(user_phone, final_reply)
-    else:
-        # Send fallback message directly
-        send_whatsapp_message(user_phone, response_text)
+    final_reply = response_text
+
+    # Check for Profile Update
+    updates, final_reply = extract_json("UPDATE_PROFILE", final_reply)
+    if updates:
+        await update_user_profile(user_phone, updates)
+        if "emergency_contact" in updates:
+             final_reply += f"\n(✅ Saved Emergency Contact: {updates['emergency_contact']})"
+
+    # Check for Batch Reminders
+    reminder_list, final_reply = extract_json("SCHEDULE_REMINDERS", final_reply)
+    if reminder_list:
+        try:
+            for item in reminder_list:
+                r_time = datetime.fromisoformat(item['time'])
+                await create_reminder(user_id, r_time, item['message'])
+                logger.info(f"Reminder set for {r_time}")
+        except Exception as e:
+            logger.error(f"Reminder Batch Error: {e}")
+
+    # Check for SOS
+    if "[[SOS]]" in response_text:
+        final_reply = final_reply.replace("[[SOS]]", "").strip()
+        contact = user.get('emergency_contact')
+        if contact:
+            logger.warning(f"SOS Triggered for user {user_phone}")
+            await send_whatsapp_message(contact, f"🚨 EMERGENCY: {user_name} ({user_phone}) needs help! Message: '{message_body}'")
+            final_reply += "\n\n🚨 **I HAVE ALERTED YOUR EMERGENCY CONTACT.** Help is on the way."
+        else:
+             final_reply += "\n\n⚠️ **I tried to alert your family, but NO Emergency Contact is saved!** Please call 102/108 immediately."
+
+    # 6. Save interactions (one batched insert instead of two round trips)
+    await save_messages(user_id, [("user", message_body), ("assistant", final_reply)])
+
+    # 7. Send Response
+    await send_whatsapp_message(user_phone, final_reply)
 
 async def handle_incoming_message(payload: Dict[str, Any]):
     try:
@@ -570,10 +664,24 @@ async def verify_webhook(request: Request):
             raise HTTPException(status_code=403, detail="Verification failed")
     return JSONResponse(content={"error": "Missing parameters"}, status_code=400)
 
+# Webhook payloads are queued and chewed through by long-running worker
+# tasks so Meta gets its 200 immediately and bursts don't pile up inside
+# request tasks. The bounded queue applies back-pressure under overload.
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_WORKERS = 8
+
+async def _webhook_worker(queue: asyncio.Queue):
+    while True:
+        payload = await queue.get()
+        try:
+            await handle_incoming_message(payload)
+        finally:
+            queue.task_done()
+
 @app.post("/webhook")
-async def webhook_handler(request: Request, background_tasks: BackgroundTasks):
-    payload = await request.json()
-    background_tasks.add_task(handle_incoming_message, payload)
+async def webhook_handler(request: Request):
+    payload = orjson.loads(await request.body())
+    await app.state.webhook_queue.put(payload)
     return {"status": "received"}
 
 # --- Scheduler ---
@@ -581,40 +689,49 @@ async def webhook_handler(request: Request, background_tasks: BackgroundTasks):
 async def check_Reminders():
     try:
         now = datetime.now()
-        # Get pending reminders
-        response = await async_supabase(
-            supabase.table("reminders")
-            .select("*")
-            .eq("status", "pending")
-            .lte("reminder_time", now.isoformat())
-        )
-        
+        db = await get_supabase()
+        # Get pending reminders (project only the columns the sweep reads;
+        # see supabase_indexes.sql for the matching partial index)
+        response = await db.table("reminders")\
+            .select("id,user_id,reminder_time,message")\
+            .eq("status", "pending")\
+            .lte("reminder_time", now.isoformat())\
+            .execute()
+
         reminders = response.data
-        
+
         if reminders:
             logger.info(f"Found {len(reminders)} pending reminders")
-            for reminder in reminders:
-                try:
-                    # Get user phone number
-                    user_response = await async_supabase(
-                        supabase.table("users").select("phone_number").eq("id", reminder['user_id']).single()
-                    )
-                    
-                    if user_response.data:
-                        phone = user_response.data['phone_number']
-                        message = f"⏰ Reminder: {reminder['message']}"
-                        send_whatsapp_message(phone, message)
-                        
-                        # Mark as sent
-                        await async_supabase(
-                            supabase.table("reminders").update({"status": "sent"}).eq("id", reminder['id'])
-                        )
-                        logger.info(f"✅ Sent reminder {reminder['id']} to {phone}")
-                    else:
-                        logger.warning(f"User not found for reminder {reminder['id']}")
-                except Exception as e:
-                    logger.error(f"Failed to send reminder {reminder['id']}: {e}")
-                
+
+            # One batched lookup for every phone number instead of one query per reminder
+            user_ids = list({r['user_id'] for r in reminders})
+            users_response = await db.table("users")\
+                .select("id,phone_number")\
+                .in_("id", user_ids)\
+                .execute()
+            phone_by_user = {u['id']: u['phone_number'] for u in (users_response.data or [])}
+
+            sent_ids = []
+
+            async def _dispatch(reminder):
+                phone = phone_by_user.get(reminder['user_id'])
+                if not phone:
+                    logger.warning(f"User not found for reminder {reminder['id']}")
+                    return
+                if await send_whatsapp_message(phone, f"⏰ Reminder: {reminder['message']}"):
+                    sent_ids.append(reminder['id'])
+                    logger.info(f"✅ Sent reminder {reminder['id']} to {phone}")
+
+            # Overlap all sends: N reminders cost ~1 Graph RTT instead of N
+            results = await asyncio.gather(*(_dispatch(r) for r in reminders), return_exceptions=True)
+            for reminder, result in zip(reminders, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to send reminder {reminder['id']}: {result}")
+
+            # One batched status update instead of one UPDATE per reminder
+            if sent_ids:
+                await db.table("reminders").update({"status": "sent"}).in_("id", sent_ids).execute()
+
     except Exception as e:
         logger.error(f"Scheduler Error: {e}")
 
@@ -624,17 +741,52 @@ async def health_check():
 
 @app.on_event("startup")
 async def startup_event():
-    scheduler.add_job(check_Reminders, IntervalTrigger(seconds=60))
-    scheduler.start()
-    logger.info("Scheduler started.")
-    # Validate WhatsApp token on startup - fail fast so you know immediately
-    validate_whatsapp_token()
+    # Size the default executor explicitly so to_thread offloads (e.g. image
+    # downscaling) never queue behind the tiny min(32, cpus+4) default pool
+    # on small webhost boxes.
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="jiva-worker")
+    )
+    _get_whatsapp_client()
+    app.state.webhook_queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+    app.state.webhook_workers = [
+        asyncio.create_task(_webhook_worker(app.state.webhook_queue))
+        for _ in range(WEBHOOK_WORKERS)
+    ]
+    # The reminder sweep must run in exactly one process or users get
+    # duplicate WhatsApp reminders; when scaling out, set RUN_SCHEDULER=0
+    # everywhere but one process.
+    if os.getenv("RUN_SCHEDULER", "1") == "1":
+        scheduler.add_job(check_Reminders, IntervalTrigger(seconds=60))
+        scheduler.start()
+        logger.info("Scheduler started.")
+        # Validate WhatsApp token on startup - fail fast so you know immediately
+        await validate_whatsapp_token()
+    logger.info("Jiva Brains loaded: %s", MODELS_TO_TRY)
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
+    if scheduler.running:
+        scheduler.shutdown()
+    for worker in app.state.webhook_workers:
+        worker.cancel()
+    await asyncio.gather(*app.state.webhook_workers, return_exceptions=True)
+    if whatsapp_client is not None:
+        await whatsapp_client.aclose()
     logger.info("Scheduler shutdown.")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop + httptools cut per-request event-loop overhead vs the default
+    # asyncio loop (install via uvicorn[standard]). POSIX-only.
+    # Default to a single worker: the scheduler, TTL caches, reminder_wake
+    # event, and webhook queue are all per-process. Scale with
+    # WEB_CONCURRENCY and set RUN_SCHEDULER=0 on all but one process.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
\ No newline at end of file
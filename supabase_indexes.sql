@@ -0,0 +1,15 @@
+-- Indexes for the hot query paths. Run once in the Supabase SQL editor.
+
+-- check_Reminders polls every 60s with: status = 'pending' AND reminder_time <= now.
+-- The partial index keeps it O(log N) and stays tiny since sent rows are excluded.
+CREATE INDEX IF NOT EXISTS idx_reminders_pending_due
+    ON reminders (reminder_time)
+    WHERE status = 'pending';
+
+-- get_chat_history: newest N messages for one user.
+CREATE INDEX IF NOT EXISTS idx_chat_history_user_recent
+    ON chat_history (user_id, created_at DESC);
+
+-- get_user: lookup by phone number on every inbound message.
+CREATE INDEX IF NOT EXISTS idx_users_phone_number
+    ON users (phone_number);
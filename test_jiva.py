@@ -1,7 +1,22 @@
 import asyncio
 import logging
+import mimetypes
+import os
+import re
 import sys
-from main import processing_pipeline, get_user
+import time
+
+# Parse the OS mime databases once at import instead of lazily inside the
+# download path.
+mimetypes.init()
+from datetime import datetime
+from main import (
+    processing_pipeline,
+    get_user,
+    get_supabase,
+    update_user_profile,
+    check_Reminders,
+)
 
 # Configure logging to show only JivaBackend logs or errors
 logging.basicConfig(level=logging.INFO)
@@ -9,12 +24,51 @@ logger = logging.getLogger("JivaBackend")
 
 # Mock the WhatsApp sender to print to terminal instead
 import main
-def mock_send_whatsapp_message(to_phone, message):
+async def mock_send_whatsapp_message(to_phone, message):
     print(f"\n[JIVA]: {message}\n")
+    # Report success like the real sender: check_Reminders only marks a
+    # reminder sent on a truthy return, so without this the sweep would
+    # re-deliver the same reminders forever in terminal mode.
+    return True
 
 # Apply the mock
 main.send_whatsapp_message = mock_send_whatsapp_message
 
+# 'image: "path with spaces" caption' or 'image: path caption' — one regex
+# scan instead of the old multi-branch parse with repeated filesystem probes.
+# Unquoted paths cannot contain spaces; quote them.
+_IMG_RE = re.compile(r'^image:\s*(?:"(?P<q>[^"]+)"|(?P<p>\S+))\s*(?P<cap>.*)$')
+
+# Media mocks for local image testing: main calls get_media_url -> URL ->
+# download_media(URL), so we patch both to serve a local file instead.
+class _MockDownloader:
+    """Callable stand-in for main.download_media that serves a local file.
+
+    One instance (one code object) lives for the whole session; the image
+    branch just repoints .path/.mime instead of building a new closure per
+    turn. The disk read runs off the loop so a multi-MB image doesn't stall
+    the scheduler task or concurrent stress-test turns.
+    """
+    def __init__(self):
+        self.path = None
+        self.mime = None
+
+    def _read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    async def __call__(self, url):
+        try:
+            return await asyncio.to_thread(self._read), self.mime or "image/jpeg"
+        except OSError as e:
+            print(f"Error reading local file: {e}")
+            return None, None
+
+_mock_downloader = _MockDownloader()
+
+async def mock_get_media_url(mid):
+    return "http://local-test/image.jpg"
+
 async def run_chat():
     print("--- Jiva Local Terminal Mode ---")
     print("Simulating phone number: +919999999999")
@@ -28,98 +82,92 @@ async def run_chat():
         print("[System]: Creating new test user...")
     else:
         # FORCE RESET NAME to avoid "Period Cramps" name glitch
-        from main import update_user_profile
         await update_user_profile(test_phone, {"name": "Test User"})
         print("[System]: User Name reset to 'Test User' for clean session.")
     
-    # Start Manual Scheduler Loop
+    # Start Manual Scheduler Loop.
+    # Instead of polling every 10s, sleep until the next due reminder and
+    # let main.reminder_wake cut the wait short whenever one is created.
+    async def next_reminder_delay(default=60.0):
+        try:
+            db = await get_supabase()
+            resp = await db.table("reminders")\
+                .select("reminder_time")\
+                .eq("status", "pending")\
+                .order("reminder_time")\
+                .limit(1)\
+                .execute()
+            if resp.data:
+                due = datetime.fromisoformat(resp.data[0]['reminder_time'])
+                # Supabase may return tz-aware timestamps (+00:00); normalize
+                # to naive local time before subtracting or the comparison
+                # raises TypeError.
+                if due.tzinfo is not None:
+                    due = due.astimezone().replace(tzinfo=None)
+                delta = (due - datetime.now()).total_seconds()
+                if delta <= 0:
+                    # Already due: the sweep that just ran handled it (or it
+                    # keeps failing). Fall back to the default interval
+                    # instead of busy-spinning on the 0.5s floor.
+                    return default
+                return max(0.5, min(default, delta))
+        except Exception as e:
+            print(f"[System]: Could not compute next reminder delay: {e}")
+        return default
+
     async def scheduler_loop():
         print("[System]: Scheduler loop started.")
         while True:
-            await asyncio.sleep(10) # Check every 10 seconds
+            main.reminder_wake.clear()
+            delay = await next_reminder_delay()
+            try:
+                await asyncio.wait_for(main.reminder_wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            # check_Reminders guards its own DB/send failures; only loop-level
+            # runtime errors can surface here.
             try:
-                from main import check_Reminders
                 await check_Reminders()
-            except Exception as e:
+            except (RuntimeError, OSError) as e:
                 print(f"[System]: Scheduler Error: {e}")
 
     # Run scheduler in background
-    asyncio.create_task(scheduler_loop())
+    sched_task = asyncio.create_task(scheduler_loop())
+
+    # Install the media mocks once for the whole session
+    main.download_media = _mock_downloader
+    main.get_media_url = mock_get_media_url
+
+    # Hook stdin into the event loop directly: no thread-pool hop and no
+    # self-pipe wakeup per prompt, unlike run_in_executor(None, input, ...).
+    loop = asyncio.get_event_loop()
+    stdin_reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdin_reader), sys.stdin)
 
     while True:
-        user_input = await asyncio.get_event_loop().run_in_executor(None, input, "[YOU]: ")
+        print("[YOU]: ", end="", flush=True)
+        line = await stdin_reader.readline()
+        if not line:  # EOF (e.g. piped input exhausted)
+            break
+        user_input = line.decode().rstrip("\n")
         if user_input.lower() in ["exit", "quit"]:
             break
             
         # Handle Image Input for Testing
         media_id = None
-        if user_input.startswith("image:"):
+        m = _IMG_RE.match(user_input)
+        if m:
+            image_path = m.group('q') or m.group('p')
+            caption = m.group('cap').strip() or "Analyze this prescription."
+            # isfile: same stat() cost as exists, but a directory (e.g.
+            # 'image: /tmp') is flagged here instead of failing on open()
+            if not os.path.isfile(image_path):
+                print(f"[System]: Warning: '{image_path}' is not a readable file.")
 
-            import os
-            # Removing prefix
-            content = user_input[6:].strip()
-            
-            # Simple heuristic: If it starts with quote, take until next quote
-            if content.startswith('"'):
-                try:
-                    end_quote = content.index('"', 1)
-                    image_path = content[1:end_quote]
-                    caption = content[end_quote+1:].strip()
-                except ValueError:
-                    image_path = content.replace('"', '')
-                    caption = ""
-            else:
-                # No quotes: First space is separator? Or assume whole thing is path?
-                # If path has spaces but no quotes, we assume whole thing is path unless we find a valid file
-                if os.path.exists(content):
-                    image_path = content
-                    caption = "Analyze this prescription."
-                elif " " in content:
-                     # Try splitting at first space
-                     p, c = content.split(" ", 1)
-                     if os.path.exists(p):
-                         image_path = p
-                         caption = c
-                     else:
-                         # Assume whole string is path (maybe just a typo in path)
-                         image_path = content
-                         caption = "Analyze this prescription."
-                else:
-                    image_path = content
-                    caption = "Analyze this prescription."
-
-            if not caption:
-                caption = "Analyze this prescription."
-            
             print(f"[System]: Simulating image upload from '{image_path}'...")
-            # We can't easily mock the media_id download flow without a real server, 
-            # so for LOCAL TEST, we will modify processing_pipeline to accept an image object directly if needed,
-            # OR we just rely on the text description for now if we can't upload.
-            # But wait! 'main.py' uses 'download_media'. 
-            # In test mode, we should probably mock 'download_media' to return local file bytes.
-            
-            # Monkey Patch main.download_media for this session
-            async def mock_download_media(url):
-                try:
-                    import mimetypes
-                    mime_type, _ = mimetypes.guess_type(image_path)
-                    if not mime_type:
-                        mime_type = "image/jpeg" # Default fallback
-                        
-                    with open(image_path, "rb") as f:
-                        return f.read(), mime_type
-                except Exception as e:
-                    print(f"Error reading local file: {e}")
-                    return None, None
-            
-            main.download_media = mock_download_media
-            
-            # We pass a fake media_id. Main calls get_media_url -> returns URL -> download_media(URL)
-            # We also need to mock get_media_url to return a dummy URL
-            async def mock_get_media_url(mid):
-                return "http://local-test/image.jpg"
-            main.get_media_url = mock_get_media_url
-            
+            # We pass a fake media_id; the pre-installed mocks serve the file.
+            _mock_downloader.path = image_path
+            _mock_downloader.mime = mimetypes.guess_type(image_path)[0] or "image/jpeg"
             media_id = "test_media_id_123"
             user_input = caption
 
@@ -128,8 +176,21 @@ async def run_chat():
         except Exception as e:
             print(f"[System]: Error: {e}")
 
+    # Cancel the scheduler cleanly instead of letting loop teardown kill it
+    # mid-await ("Task was destroyed but it is pending!" warnings).
+    sched_task.cancel()
+    await asyncio.gather(sched_task, return_exceptions=True)
+
 # --- Automated Verification ---
 # --- Automated Verification & Stress Testing ---
+
+# 10KB edge-case payload, built once at import instead of per run
+_HUGE_INPUT = "A" * 10000
+
+# Note on profile lookups: get_user carries a 60s in-process TTL cache in
+# main, so only the first scenario of a run pays the Supabase round trip —
+# no extra caching layer is needed here.
+
 async def automated_diagnostics():
     print("\n" + "="*50)
     print("🚀 STARTING JIVA SYSTEM STRESS TEST")
@@ -146,39 +207,71 @@ async def automated_diagnostics():
         ("Testing System Safety (SOS)", "HELP! I am having chest pain!"),
     ]
     
-    import time
-    for test_name, input_text in functional_scenarios:
-        print(f"\n[TEST]: {test_name}")
-        print(f"[INPUT]: {input_text}")
-        try:
-            start_t = time.time()
-            await processing_pipeline(test_phone, input_text)
-            print(f"✅ PASSED (Time: {round(time.time() - start_t, 2)}s)")
-        except Exception as e:
-            print(f"❌ FAILED: {e}")
-        print("-" * 20)
-        await asyncio.sleep(2)
+    # Fire scenarios concurrently; the semaphore bounds in-flight requests
+    # to the backend's capacity (instead of fixed sleeps), giving real
+    # back-pressure when the pipeline stalls.
+    sem = asyncio.Semaphore(int(os.getenv("JIVA_STRESS_CONCURRENCY", "4")))
+    counts = {"ok": 0, "err": 0}
+
+    async def _report():
+        while True:
+            await asyncio.sleep(1)
+            print(f"[STATS]: {counts['ok']} ok / {counts['err']} err")
+
+    async def _run_one(test_name, input_text):
+        async with sem:
+            # perf_counter is monotonic and high-resolution; time.time is
+            # wall clock and can jump under NTP adjustments.
+            start_t = time.perf_counter()
+            try:
+                await processing_pipeline(test_phone, input_text)
+                counts["ok"] += 1
+                elapsed = time.perf_counter() - start_t
+                print(f"\n[TEST]: {test_name}")
+                print(f"[INPUT]: {input_text}")
+                print(f"✅ PASSED (Time: {elapsed*1000:.1f}ms)")
+            except Exception as e:
+                counts["err"] += 1
+                print(f"\n[TEST]: {test_name}")
+                print(f"❌ FAILED: {e}")
+            print("-" * 20)
+
+    reporter = asyncio.create_task(_report())
+
+    tasks = [asyncio.create_task(_run_one(n, t)) for n, t in functional_scenarios]
+    await asyncio.gather(*tasks, return_exceptions=True)
 
     # 2. Edge Case & Fuzz Testing
     print("\n[PHASE 2]: FAULTS & EDGE CASES")
     edge_cases = [
         ("Empty Input", ""),
         ("Whitespace Input", "   "),
-        ("Huge Input", "A" * 10000), # 10KB text
+        ("Huge Input", _HUGE_INPUT), # 10KB text
         ("Special Characters", "Hello @#$%^&*()_+"),
         ("SQL Injection Attempt", "SELECT * FROM users"),
     ]
-    
-    for test_name, input_text in edge_cases:
-        print(f"\n[TEST]: {test_name}")
-        try:
-             # Should not crash
-             await processing_pipeline(test_phone, input_text)
-             print("✅ HANDLED (No Crash)")
-        except Exception as e:
-             print(f"❌ CRASHED: {e}")
-        print("-" * 20)
-        await asyncio.sleep(1)
+
+    async def _run_edge(test_name, input_text):
+        async with sem:
+            try:
+                 # Should not crash
+                 await processing_pipeline(test_phone, input_text)
+                 counts["ok"] += 1
+                 print(f"\n[TEST]: {test_name}")
+                 print("✅ HANDLED (No Crash)")
+            except Exception as e:
+                 counts["err"] += 1
+                 print(f"\n[TEST]: {test_name}")
+                 print(f"❌ CRASHED: {e}")
+            print("-" * 20)
+
+    tasks = [asyncio.create_task(_run_edge(n, t)) for n, t in edge_cases]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Await the cancellation so the task is finished before loop teardown
+    # (same clean-shutdown pattern as the chat scheduler task).
+    reporter.cancel()
+    await asyncio.gather(reporter, return_exceptions=True)
 
     print("\n✅ STRESS TEST COMPLETE.")
     print("If you see '✅ HANDLED' for all edge cases, the system is ROBUST.")
@@ -188,22 +281,22 @@ async def automated_diagnostics():
 async def clear_history():
     print(f"\n[System]: Clearing chat history and resetting profile for +919999999999...")
     try:
-        from main import supabase, async_supabase, get_user, update_user_profile
-        
         user = await get_user("+919999999999")
         if user:
-            # 1. Clear Chat History for user
-            await async_supabase(
-                supabase.table("chat_history").delete().eq("user_id", user['id'])
+            db = await get_supabase()
+            # The history delete and profile reset hit independent tables —
+            # overlap them so --clear costs max(RTT) instead of the sum.
+            # (Profile reset matters: tests might have saved 'Period Cramps' as the name)
+            await asyncio.gather(
+                db.table("chat_history").delete().eq("user_id", user['id']).execute(),
+                update_user_profile("+919999999999", {
+                    "name": "Test User", # RESET NAME!
+                    "medical_history": None,
+                    "allergies": None,
+                    "blood_group": None,
+                    "emergency_contact": None
+                }),
             )
-            # 2. Reset Profile (Important: Test might have saved 'Period Cramps' to profile)
-            await update_user_profile("+919999999999", {
-                "name": "Test User", # RESET NAME!
-                "medical_history": None,
-                "allergies": None,
-                "blood_group": None,
-                "emergency_contact": None
-            })
             print("✅ History & Profile Cleared.")
         else:
             print("User not found (nothing to clear).")
@@ -211,14 +304,33 @@ async def clear_history():
     except Exception as e:
         print(f"Error clearing history: {e}")
 
+# Faster socket/pipe I/O when available; the selector loop is a fine fallback.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 if __name__ == "__main__":
+    import concurrent.futures
+
+    # One shared loop + sized executor for every mode, instead of each
+    # asyncio.run() spinning up and tearing down its own.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+        max_workers=int(os.getenv("THREAD_POOL_SIZE", "32")),
+        thread_name_prefix="jiva-test",
+    ))
     try:
         if len(sys.argv) > 1:
             if sys.argv[1] == "--test-all":
-                asyncio.run(automated_diagnostics())
+                loop.run_until_complete(automated_diagnostics())
             elif sys.argv[1] == "--clear":
-                asyncio.run(clear_history())
+                loop.run_until_complete(clear_history())
         else:
-            asyncio.run(run_chat())
+            loop.run_until_complete(run_chat())
     except KeyboardInterrupt:
         print("\n[System]: Stopped.")
+    finally:
+        loop.close()
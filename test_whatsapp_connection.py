@@ -1,5 +1,6 @@
 import os
-import requests
+import asyncio
+import httpx
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -10,9 +11,17 @@ WHATSAPP_PHONE_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 
 # Hardcoded recipient for testing (You can change this)
 # The test number must be added in the Meta Dashboard if using a test account.
-RECIPIENT_PHONE = "919319108107" 
+RECIPIENT_PHONE = "919319108107"
 
-def test_send_message():
+# One HTTP/2 keep-alive client for the whole script — repeated sends reuse
+# the connection instead of paying a fresh TCP+TLS handshake each time.
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+async def test_send_message():
     print("--- WhatsApp Connection Test ---")
     print(f"Phone ID: {WHATSAPP_PHONE_ID}")
     print(f"Token: {WHATSAPP_TOKEN[:10]}..." if WHATSAPP_TOKEN else "Token: MISSING")
@@ -35,8 +44,8 @@ def test_send_message():
 
     try:
         print(f"Sending message to {RECIPIENT_PHONE}...")
-        response = requests.post(url, headers=headers, json=data)
-        
+        response = await client.post(url, headers=headers, json=data)
+
         if response.status_code == 200:
             print("✅ SUCCESS! Message sent.")
             print("Response:", response.json())
@@ -46,5 +55,11 @@ def test_send_message():
     except Exception as e:
         print(f"❌ Exception: {e}")
 
+async def main():
+    try:
+        await test_send_message()
+    finally:
+        await client.aclose()
+
 if __name__ == "__main__":
-    test_send_message()
+    asyncio.run(main())